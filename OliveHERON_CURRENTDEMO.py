@@ -4,12 +4,40 @@ import os
 import sys
 import requests
 from bs4 import BeautifulSoup
+import soupsieve
 import webbrowser
 from pathlib import Path
 from better_profanity import profanity
 import zipfile
 import re
 import threading
+import math
+import hashlib
+import json
+import queue
+import base64
+import posixpath
+import subprocess
+import xml.etree.ElementTree as ET
+import functools
+import codecs
+import html
+import itertools
+import time
+from html.parser import HTMLParser
+import io
+from collections import Counter, OrderedDict, deque
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+from urllib.parse import unquote, urljoin, urlparse
 
 # --- OliveHERON Theme Configuration ---
 OLIVE = "#708238"
@@ -52,7 +80,9 @@ settings = {
     'default_download_dir': str(Path.home() / "Downloads"),
     'default_app': '',
     'per_ext_app': {},
-    'user_searchbases': []
+    'user_searchbases': [],
+    'stream_scrape': True,
+    'show_covers': False
 }
 
 SETTINGS_FILE = "oliveheron_settings.txt"
@@ -272,6 +302,7 @@ def show_tutorial():
         "- Set your default downloads folder\n"
         "- Choose which app opens files by default, or set apps per file extension (Advanced)\n"
         "- Add custom searchbases (websites) to include in your search\n"
+        "  e.g. https://example.org/search?q={query} | row=.result | title=h3 | link=a\n"
         "- Enable/disable explicit content filtering (profanity, mature, adult, etc)\n"
         "- Toggle whether Welcome/Tutorial popups appear on startup\n"
         "\n"
@@ -279,6 +310,7 @@ def show_tutorial():
         "- Select a file and click 'Download Selected'.\n"
         "- Select multiple files for batch download (as zip or individually).\n"
         "- Use 'Save to...' to pick a custom download folder for this session.\n"
+        "- Click 'Library' to browse books already in your download folder.\n"
         "\n"
         "Enjoy OliveHERON!\n"
         "\n"
@@ -299,6 +331,113 @@ def show_tutorial():
                  scrollable=True)
 
 
+# --- Streaming Scrape ---
+
+STREAM_CHUNK_SIZE = 16 * 1024
+STREAM_REFRESH = 0.25  # seconds between pushing partial results to the table
+
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr'
+}
+
+IMPLIED_END_PARENTS = {'tr': {'table'}, 'li': {'ul', 'ol'}}
+
+
+def has_class(attrs, class_name):
+    return class_name in (dict(attrs).get('class') or "").split()
+
+
+class RowStreamParser(HTMLParser):
+    # Incremental parser that only buffers markup for the row currently being
+    # read. Each finished row is queued as a string; everything outside rows
+    # is dropped as soon as it is parsed.
+
+    def __init__(self, row_tag, row_class=None, within=None):
+        super().__init__(convert_charrefs=True)
+        self.row_tag = row_tag
+        self.row_class = row_class
+        self.within = within
+        self.within_depth = 0
+        self.stack = None  # open tags inside the current row
+        self.buffer = []
+        self.rows = []
+
+    def in_scope(self):
+        return self.within is None or self.within_depth > 0
+
+    def is_row(self, tag, attrs):
+        return tag == self.row_tag and (self.row_class is None
+                                        or has_class(attrs, self.row_class))
+
+    def finish_row(self):
+        self.rows.append("".join(self.buffer))
+        self.buffer = []
+        self.stack = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.within and tag == self.within[0] and (
+                self.within_depth or has_class(attrs, self.within[1])):
+            self.within_depth += 1
+        if (self.stack is not None and tag == self.row_tag
+                and tag in IMPLIED_END_PARENTS and
+                not set(self.stack) & IMPLIED_END_PARENTS[tag]):
+            # A new <tr>/<li> implicitly closes an unterminated sibling row
+            self.finish_row()
+        if self.stack is None:
+            if not (self.in_scope() and self.is_row(tag, attrs)):
+                return
+            self.stack = []
+        self.buffer.append(self.get_starttag_text())
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if self.stack is not None:
+            self.buffer.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if self.stack is not None and tag in self.stack:
+            self.buffer.append(f"</{tag}>")
+            # Pop implicitly closed elements (e.g. unterminated <td>s)
+            while self.stack.pop() != tag:
+                pass
+            if not self.stack:
+                self.finish_row()
+        if self.within and tag == self.within[0] and self.within_depth:
+            self.within_depth -= 1
+            if not self.within_depth and self.stack is not None:
+                self.finish_row()
+
+    def handle_data(self, data):
+        if self.stack is not None:
+            self.buffer.append(html.escape(data, quote=False))
+
+    def pop_rows(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+
+def stream_rows(url, row_tag, row_class=None, within=None, **kwargs):
+    # Yields each matching row as a small BeautifulSoup element while the
+    # response is still downloading.
+    parser = RowStreamParser(row_tag, row_class, within)
+    with requests.get(url, stream=True, **kwargs) as resp:
+        try:
+            decoder = codecs.getincrementaldecoder(resp.encoding
+                                                   or "utf-8")("replace")
+        except LookupError:
+            decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        for chunk in resp.iter_content(STREAM_CHUNK_SIZE):
+            parser.feed(decoder.decode(chunk))
+            for markup in parser.pop_rows():
+                yield BeautifulSoup(markup, "html.parser").find(row_tag)
+        parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+        for markup in parser.pop_rows():
+            yield BeautifulSoup(markup, "html.parser").find(row_tag)
+
+
 # --- Scraper Functions for Each Source ---
 
 
@@ -350,27 +489,39 @@ def scrape_ravebooksearch(query, results, lock, filter_explicit):
         print("RaveBookSearch error:", e)
 
 
+def parse_annas_row(row):
+    title_elem = row.select_one('.search-result-title')
+    title = title_elem.get_text(strip=True) if title_elem else ""
+    author_elem = row.select_one('.search-result-authors')
+    author = author_elem.get_text(strip=True) if author_elem else ""
+    year_elem = row.select_one('.search-result-pubyear')
+    year = year_elem.get_text(strip=True) if year_elem else ""
+    ext_elem = row.select_one('.search-result-format')
+    ext = ext_elem.get_text(strip=True) if ext_elem else ""
+    link_elem = row.select_one('a')
+    link = "https://annas-archive.org" + link_elem[
+        'href'] if link_elem and link_elem.has_attr('href') else ""
+    src = "Anna's Archive"
+    return (title, author, year, ext, src, link)
+
+
 def scrape_annas_archive(query, results, lock, filter_explicit):
     # Anna's Archive meta-search
     search_url = f"https://annas-archive.org/search?q={requests.utils.quote(query)}"
+    headers = {"User-Agent": "Mozilla/5.0"}
     try:
-        resp = requests.get(search_url,
-                            timeout=15,
-                            headers={"User-Agent": "Mozilla/5.0"})
-        soup = BeautifulSoup(resp.text, "html.parser")
-        for row in soup.select('.search-result'):
-            title_elem = row.select_one('.search-result-title')
-            title = title_elem.get_text(strip=True) if title_elem else ""
-            author_elem = row.select_one('.search-result-authors')
-            author = author_elem.get_text(strip=True) if author_elem else ""
-            year_elem = row.select_one('.search-result-pubyear')
-            year = year_elem.get_text(strip=True) if year_elem else ""
-            ext_elem = row.select_one('.search-result-format')
-            ext = ext_elem.get_text(strip=True) if ext_elem else ""
-            link_elem = row.select_one('a')
-            link = "https://annas-archive.org" + link_elem[
-                'href'] if link_elem and link_elem.has_attr('href') else ""
-            src = "Anna's Archive"
+        if settings.get('stream_scrape', True):
+            rows = stream_rows(search_url,
+                               'div',
+                               row_class='search-result',
+                               timeout=15,
+                               headers=headers)
+        else:
+            resp = requests.get(search_url, timeout=15, headers=headers)
+            soup = BeautifulSoup(resp.text, "html.parser")
+            rows = soup.select('.search-result')
+        for row in rows:
+            title, author, year, ext, src, link = parse_annas_row(row)
             if filter_explicit and profanity.contains_profanity(title + " " +
                                                                 author):
                 continue
@@ -380,25 +531,41 @@ def scrape_annas_archive(query, results, lock, filter_explicit):
         print("Anna's Archive error:", e)
 
 
+def parse_libgen_row(row):
+    cols = row.find_all('td')
+    if len(cols) < 9:
+        return None
+    title = cols[2].get_text(strip=True)
+    author = cols[1].get_text(strip=True)
+    year = cols[4].get_text(strip=True)
+    ext = cols[8].get_text(strip=True)
+    link = cols[2].find('a')['href'] if cols[2].find('a') else ""
+    src = "LibGen"
+    return (title, author, year, ext, src, link)
+
+
 def scrape_libgen(query, results, lock, filter_explicit):
     # LibGen (fiction) search
     search_url = f"http://libgen.rs/fiction/?q={requests.utils.quote(query)}"
     try:
-        resp = requests.get(search_url, timeout=15)
-        soup = BeautifulSoup(resp.text, "html.parser")
-        table = soup.find('table', {'class': 'catalog'})
-        if not table:
-            return
-        for row in table.find_all('tr')[1:]:
-            cols = row.find_all('td')
-            if len(cols) < 9:
+        if settings.get('stream_scrape', True):
+            rows = itertools.islice(
+                stream_rows(search_url,
+                            'tr',
+                            within=('table', 'catalog'),
+                            timeout=15), 1, None)
+        else:
+            resp = requests.get(search_url, timeout=15)
+            soup = BeautifulSoup(resp.text, "html.parser")
+            table = soup.find('table', {'class': 'catalog'})
+            if not table:
+                return
+            rows = table.find_all('tr')[1:]
+        for row in rows:
+            result = parse_libgen_row(row)
+            if result is None:
                 continue
-            title = cols[2].get_text(strip=True)
-            author = cols[1].get_text(strip=True)
-            year = cols[4].get_text(strip=True)
-            ext = cols[8].get_text(strip=True)
-            link = cols[2].find('a')['href'] if cols[2].find('a') else ""
-            src = "LibGen"
+            title, author, year, ext, src, link = result
             if filter_explicit and profanity.contains_profanity(title + " " +
                                                                 author):
                 continue
@@ -408,27 +575,208 @@ def scrape_libgen(query, results, lock, filter_explicit):
         print("LibGen error:", e)
 
 
+IA_SEARCH_URL = "https://archive.org/advancedsearch.php"
+IA_METADATA_URL = "https://archive.org/metadata/{identifier}/files"
+IA_DOWNLOAD_URL = "https://archive.org/download/{identifier}/{name}"
+IA_FIELDS = ['identifier', 'title', 'creator', 'year']
+IA_PAGE_SIZE = 250
+IA_MAX_PAGES = 2
+IA_BATCH_SIZE = 50
+
+# Internet Archive format names, in order of preference
+IA_FORMAT_EXTS = [
+    ('EPUB', 'epub'), ('Text PDF', 'pdf'), ('PDF', 'pdf'),
+    ('Kindle', 'mobi'), ('Mobipocket', 'mobi'), ('DjVuTXT', 'txt'),
+    ('Text', 'txt'), ('HTML', 'html'), ('ZIP', 'zip')
+]
+
+ia_format_cache = {}  # identifier -> ext ("" if nothing supported)
+ia_files_cache = {}  # identifier -> list of file dicts
+ia_cache_lock = threading.Lock()
+
+
+def ia_identifier(url):
+    match = re.search(r'archive\.org/details/([^/?#]+)', url)
+    return match.group(1) if match else None
+
+
+def ia_ext_from_formats(formats):
+    if isinstance(formats, str):
+        formats = [formats]
+    formats = set(formats or [])
+    for fmt, ext in IA_FORMAT_EXTS:
+        if fmt in formats:
+            return ext
+    return ""
+
+
+def ia_fetch_formats(identifiers):
+    # Resolve the best supported ext for many items with one search request
+    # per batch, instead of one metadata request per item.
+    found = {}
+    with ia_cache_lock:
+        missing = []
+        for identifier in identifiers:
+            if identifier in ia_format_cache:
+                found[identifier] = ia_format_cache[identifier]
+            else:
+                missing.append(identifier)
+    for i in range(0, len(missing), IA_BATCH_SIZE):
+        batch = missing[i:i + IA_BATCH_SIZE]
+        params = {
+            'q': "identifier:(" + " OR ".join(batch) + ")",
+            'fl[]': ['identifier', 'format'],
+            'rows': len(batch),
+            'output': 'json'
+        }
+        try:
+            resp = requests.get(IA_SEARCH_URL, params=params, timeout=15)
+            docs = resp.json().get('response', {}).get('docs', [])
+        except Exception as e:
+            print("Internet Archive metadata error:", e)
+            continue
+        with ia_cache_lock:
+            for identifier in batch:
+                ia_format_cache[identifier] = ""
+            for doc in docs:
+                identifier = doc.get('identifier')
+                if identifier:
+                    ia_format_cache[identifier] = ia_ext_from_formats(
+                        doc.get('format'))
+            for identifier in batch:
+                found[identifier] = ia_format_cache[identifier]
+    return found
+
+
+def ia_fetch_files(identifier):
+    with ia_cache_lock:
+        if identifier in ia_files_cache:
+            return ia_files_cache[identifier]
+    resp = requests.get(IA_METADATA_URL.format(identifier=identifier),
+                        timeout=15)
+    files = resp.json().get('result', [])
+    with ia_cache_lock:
+        ia_files_cache[identifier] = files
+    return files
+
+
+def ia_pick_file(files, ext=""):
+    by_format = {}
+    for f in files:
+        by_format.setdefault(f.get('format'), f)
+    for fmt, fmt_ext in IA_FORMAT_EXTS:
+        if ext and fmt_ext != ext:
+            continue
+        if fmt in by_format:
+            return by_format[fmt], fmt_ext
+    if ext:
+        return ia_pick_file(files)
+    return None, ""
+
+
+def ia_build_query(query):
+    # Translate HERONSearch syntax into Lucene. Only word characters survive
+    # tokenize(), so nothing in the user's text can break the Lucene parse.
+    # author= becomes creator:, other operators are dropped. Lucene has no
+    # AND-over-OR precedence, so every AND run is parenthesised explicitly;
+    # unbalanced or empty groups are closed or dropped.
+    root = [[]]  # a group is a list of OR'd runs; a run is AND'd items
+    stack = [root]
+    for token in re.findall(r'"[^"]+"|\S+', query):
+        if token == "AND":
+            continue
+        if token == "OR":
+            if stack[-1][-1]:
+                stack[-1].append([])
+            continue
+        opens = len(token) - len(token.lstrip("("))
+        closes = len(token) - len(token.rstrip(")"))
+        token = token.strip("()")
+        op = re.match(r'^([a-z_]+(?::[a-z]+)?)[=:](.*)$', token)
+        if op:
+            key, value = op.groups()
+            words = tokenize(value)
+            if key == 'author' and words:
+                words = ["creator:(" + " AND ".join(words) + ")"]
+            elif key not in RANK_VALUE_OPS:
+                words = []
+        elif token.startswith("AROUND("):
+            words = []
+        elif token.startswith('"') and len(tokenize(token)) > 1:
+            words = ['"' + " ".join(tokenize(token)) + '"']
+        else:
+            words = tokenize(token)
+        for _ in range(opens):
+            group = [[]]
+            stack[-1][-1].append(group)
+            stack.append(group)
+        stack[-1][-1].extend(words)
+        for _ in range(closes):
+            if len(stack) > 1:
+                stack.pop()
+
+    def render(group):
+        runs = []
+        for run in group:
+            items = [item if isinstance(item, str) else render(item)
+                     for item in run]
+            items = [item for item in items if item]
+            if len(items) > 1:
+                runs.append("(" + " AND ".join(items) + ")")
+            elif items:
+                runs.append(items[0])
+        if len(runs) > 1:
+            return "(" + " OR ".join(runs) + ")"
+        return runs[0] if runs else ""
+
+    text = render(root)
+    if not text:
+        return None
+    return f"{text} AND mediatype:texts"
+
+
 def scrape_internet_archive(query, results, lock, filter_explicit):
-    search_url = f"https://archive.org/search.php?query={requests.utils.quote(query)}"
-    try:
-        resp = requests.get(search_url, timeout=15)
-        soup = BeautifulSoup(resp.text, "html.parser")
-        for row in soup.select('.item-ia'):
-            title_elem = row.select_one('.C234')
-            title = title_elem.get_text(strip=True) if title_elem else ""
-            author = ""
-            year = ""
-            ext = ""
-            link_elem = row.select_one('a')
-            link = "https://archive.org" + link_elem[
-                'href'] if link_elem and link_elem.has_attr('href') else ""
+    # JSON advanced search; format details are filled in lazily by the app
+    # for rows that are actually viewed (see ia_fetch_formats).
+    ia_query = ia_build_query(query)
+    if not ia_query:
+        return
+    for page in range(1, IA_MAX_PAGES + 1):
+        params = {
+            'q': ia_query,
+            'fl[]': IA_FIELDS,
+            'rows': IA_PAGE_SIZE,
+            'page': page,
+            'output': 'json'
+        }
+        try:
+            resp = requests.get(IA_SEARCH_URL, params=params, timeout=15)
+            data = resp.json().get('response', {})
+        except Exception as e:
+            print("Internet Archive error:", e)
+            return
+        docs = data.get('docs', [])
+        for doc in docs:
+            identifier = doc.get('identifier')
+            if not identifier:
+                continue
+            title = doc.get('title') or identifier
+            author = doc.get('creator') or ""
+            if isinstance(author, list):
+                author = "; ".join(author)
+            year = str(doc.get('year') or "")
+            with ia_cache_lock:
+                ext = ia_format_cache.get(identifier, "")
+            link = f"https://archive.org/details/{identifier}"
             src = "Internet Archive"
-            if filter_explicit and profanity.contains_profanity(title):
+            if filter_explicit and profanity.contains_profanity(title + " " +
+                                                                author):
                 continue
             with lock:
                 results.append((title, author, year, ext, src, link))
-    except Exception as e:
-        print("Internet Archive error:", e)
+        if len(docs) < IA_PAGE_SIZE or page * IA_PAGE_SIZE >= data.get(
+                'numFound', 0):
+            break
 
 
 def scrape_standard_ebooks(query, results, lock, filter_explicit):
@@ -456,15 +804,903 @@ def scrape_standard_ebooks(query, results, lock, filter_explicit):
         print("Standard Ebooks error:", e)
 
 
-def scrape_user_searchbases(query, results, lock, filter_explicit):
-    for base in settings.get('user_searchbases', []):
-        try:
-            url = base.format(query=requests.utils.quote(query))
-            resp = requests.get(url, timeout=15)
+SEARCHBASE_FIELDS = ['row', 'title', 'author', 'year', 'ext', 'link']
+
+
+def parse_searchbase(line):
+    # "URL | row=.result | title=h3 | link=a" -> {'url': ..., 'row': ...}
+    parts = [part.strip() for part in line.split(" | ")]
+    base = {'url': parts[0]}
+    for part in parts[1:]:
+        field, _, selector = part.partition("=")
+        field = field.strip().lower()
+        if field in SEARCHBASE_FIELDS and selector.strip():
+            base[field] = selector.strip()
+    return base
+
+
+def format_searchbase(base):
+    if isinstance(base, str):
+        return base
+    return " | ".join([base['url']] + [
+        f"{field}={base[field]}" for field in SEARCHBASE_FIELDS
+        if base.get(field)
+    ])
+
+
+@functools.lru_cache(maxsize=64)
+def compile_searchbase_rules(rules):
+    return {field: soupsieve.compile(selector) for field, selector in rules}
+
+
+def select_text(rule, row):
+    if rule is None:
+        return ""
+    elem = rule.select_one(row)
+    return elem.get_text(" ", strip=True) if elem else ""
+
+
+def scrape_user_searchbase(base, query, results, lock, filter_explicit):
+    if isinstance(base, str):
+        base = {'url': base}
+    try:
+        url = base['url'].format(query=requests.utils.quote(query))
+        rules = compile_searchbase_rules(
+            tuple((field, base[field]) for field in SEARCHBASE_FIELDS
+                  if base.get(field)))
+        resp = requests.get(url,
+                            timeout=15,
+                            headers={"User-Agent": "Mozilla/5.0"})
+        if 'row' not in rules:
+            # No extraction rules: the search page itself is the result
             with lock:
                 results.append((url, "", "", "", "User", url))
+            return
+        soup = BeautifulSoup(resp.text, "html.parser")
+        src = urlparse(url).netloc or "User"
+        for row in rules['row'].select(soup):
+            title = select_text(rules.get('title'), row)
+            author = select_text(rules.get('author'), row)
+            year = select_text(rules.get('year'), row)
+            ext = select_text(rules.get('ext'), row).lower().lstrip('.')
+            link_elem = rules['link'].select_one(
+                row) if 'link' in rules else row
+            if link_elem is not None and not link_elem.has_attr('href'):
+                link_elem = link_elem.find('a', href=True)
+            link = urljoin(resp.url, link_elem['href']) if link_elem else ""
+            if not title and not link:
+                continue
+            if filter_explicit and profanity.contains_profanity(title + " " +
+                                                                author):
+                continue
+            with lock:
+                results.append((title, author, year, ext, src, link))
+    except Exception as e:
+        print("User searchbase error:", base['url'], e)
+
+
+# --- Result Ranking ---
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+TITLE_WEIGHT = 2.0
+AUTHOR_WEIGHT = 1.0
+PHRASE_BOOST = 3.0
+AUTHOR_MATCH_BOOST = 2.0
+FORMAT_BOOST = 1.0
+PREFERRED_FORMATS = ['epub', 'pdf', 'mobi', 'azw3', 'txt']
+
+# Per-source quality prior, added to every row from that source
+SOURCE_PRIORS = {
+    "Standard Ebooks": 0.6,
+    "Gutenberg": 0.5,
+    "Anna's Archive": 0.4,
+    "LibGen": 0.3,
+    "Internet Archive": 0.2,
+    "RaveBookSearch": 0.0,
+    "User": 0.0
+}
+
+# Operators whose values describe the book and so count as query terms
+RANK_VALUE_OPS = ('filename', 'title', 'author', 'intext', 'allintext')
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def parse_rank_query(query):
+    terms = []
+    author_terms = []
+    ext = ""
+    for token in re.findall(r'"[^"]+"|\S+', query):
+        op = re.match(r'^([a-z_]+(?::[a-z]+)?)[=:](.*)$', token)
+        if op:
+            key, value = op.groups()
+            if key == 'ext':
+                ext = value.lower()
+            elif key in RANK_VALUE_OPS:
+                terms += tokenize(value)
+                if key == 'author':
+                    author_terms += tokenize(value)
+            continue
+        if token in ("AND", "OR") or token.startswith("AROUND("):
+            continue
+        terms += tokenize(token)
+    phrases = [" ".join(tokenize(p)) for p in re.findall(r'"([^"]+)"', query)]
+    if not phrases and len(terms) > 1:
+        phrases = [" ".join(terms)]
+    return list(dict.fromkeys(terms)), phrases, author_terms, ext
+
+
+def row_boost(title_tokens, author_tokens, ext, src, phrases, author_terms,
+              wanted_ext):
+    boost = SOURCE_PRIORS.get(src, 0.0)
+    title_text = " " + " ".join(title_tokens) + " "
+    if any(f" {phrase} " in title_text for phrase in phrases if phrase):
+        boost += PHRASE_BOOST
+    if author_terms and set(author_terms) <= set(author_tokens):
+        boost += AUTHOR_MATCH_BOOST
+    ext = (tokenize(ext) or [""])[0]
+    if wanted_ext:
+        if ext == wanted_ext:
+            boost += FORMAT_BOOST
+    elif ext in PREFERRED_FORMATS:
+        boost += FORMAT_BOOST * (1 - PREFERRED_FORMATS.index(ext) /
+                                 len(PREFERRED_FORMATS))
+    return boost
+
+
+def bm25_numpy(field_counts, field_lengths, terms):
+    n = len(field_counts[0])
+    term_index = {term: j for j, term in enumerate(terms)}
+    present = np.zeros((n, len(terms)), dtype=bool)
+    tfs = []
+    for counts in field_counts:
+        tf = np.zeros((n, len(terms)))
+        for i, doc in enumerate(counts):
+            for term, count in doc.items():
+                j = term_index.get(term)
+                if j is not None:
+                    tf[i, j] = count
+        present |= tf > 0
+        tfs.append(tf)
+    df = present.sum(axis=0)
+    idf = np.log1p((n - df + 0.5) / (df + 0.5))
+    scores = np.zeros(n)
+    for tf, lengths, weight in zip(tfs, field_lengths,
+                                   (TITLE_WEIGHT, AUTHOR_WEIGHT)):
+        lengths = np.asarray(lengths, dtype=float)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths /
+                          max(lengths.mean(), 1.0))
+        scores += weight * ((tf * (BM25_K1 + 1)) / (tf + norm[:, None])) @ idf
+    return scores
+
+
+def bm25_python(field_counts, field_lengths, terms):
+    n = len(field_counts[0])
+    df = {
+        term: sum(1 for i in range(n)
+                  if any(counts[i].get(term) for counts in field_counts))
+        for term in terms
+    }
+    idf = {
+        term: math.log1p((n - df[term] + 0.5) / (df[term] + 0.5))
+        for term in terms
+    }
+    scores = [0.0] * n
+    for counts, lengths, weight in zip(field_counts, field_lengths,
+                                       (TITLE_WEIGHT, AUTHOR_WEIGHT)):
+        avg = max(sum(lengths) / n, 1.0)
+        for i in range(n):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[i] / avg)
+            for term in terms:
+                tf = counts[i].get(term, 0)
+                if tf:
+                    scores[i] += weight * idf[term] * tf * (BM25_K1 +
+                                                            1) / (tf + norm)
+    return scores
+
+
+def rank_order(query, rows):
+    # Returns row indices, best match first. Ties keep arrival order.
+    if len(rows) < 2:
+        return list(range(len(rows)))
+    terms, phrases, author_terms, wanted_ext = parse_rank_query(query)
+    titles = [tokenize(row[0]) for row in rows]
+    authors = [tokenize(row[1]) for row in rows]
+    boosts = [
+        row_boost(t, a, row[3], row[4], phrases, author_terms, wanted_ext)
+        for t, a, row in zip(titles, authors, rows)
+    ]
+    field_counts = ([Counter(t) for t in titles],
+                    [Counter(a) for a in authors])
+    field_lengths = ([len(t) for t in titles], [len(a) for a in authors])
+    if np is not None:
+        scores = np.asarray(boosts)
+        if terms:
+            scores = scores + bm25_numpy(field_counts, field_lengths, terms)
+        return np.argsort(-scores, kind='stable').tolist()
+    scores = boosts
+    if terms:
+        scores = [
+            b + s for b, s in zip(
+                boosts, bm25_python(field_counts, field_lengths, terms))
+        ]
+    return sorted(range(len(rows)), key=lambda i: -scores[i])
+
+
+# --- Download Store ---
+
+DOWNLOAD_INDEX_FILE = ".oliveheron_index.json"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class DownloadStore:
+    # Content-addressed index of one download folder: sha256 -> file name,
+    # plus source URL -> sha256 so known URLs never hit the network again.
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.index_path = self.folder / DOWNLOAD_INDEX_FILE
+        self.lock = threading.Lock()
+        self.hashes = {}
+        self.urls = {}
+        self.load()
+
+    def load(self):
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.hashes = data.get('hashes', {})
+            self.urls = data.get('urls', {})
+        except Exception as e:
+            print("Download index load error:", e)
+
+    def save(self):
+        tmp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({'hashes': self.hashes, 'urls': self.urls}, f)
+            os.replace(tmp_path, self.index_path)
         except Exception as e:
-            print("User searchbase error:", e)
+            print("Download index save error:", e)
+
+    def path_for_hash(self, digest):
+        name = self.hashes.get(digest)
+        if name and (self.folder / name).exists():
+            return self.folder / name
+        return None
+
+    def lookup(self, url):
+        with self.lock:
+            return self.path_for_hash(self.urls.get(url))
+
+    def remember(self, urls, digest, path):
+        with self.lock:
+            self.hashes[digest] = path.name
+            for url in urls:
+                self.urls[url] = digest
+            self.save()
+
+    def fetch(self, url, filepath, source_url=None):
+        # Returns (path, downloaded); path is None if the URL isn't a file.
+        urls = [u for u in (url, source_url) if u]
+        for known in urls:
+            path = self.lookup(known)
+            if path:
+                return path, False
+        r = requests.get(url, stream=True, allow_redirects=True, timeout=20)
+        with r:
+            if r.status_code != 200:
+                return None, False
+            self.folder.mkdir(parents=True, exist_ok=True)
+            digest = hashlib.sha256()
+            part_path = filepath.with_name(filepath.name + ".part")
+            try:
+                with open(part_path, "wb") as f:
+                    for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        digest.update(chunk)
+                        f.write(chunk)
+            except Exception:
+                part_path.unlink(missing_ok=True)
+                raise
+        digest = digest.hexdigest()
+        with self.lock:
+            existing = self.path_for_hash(digest)
+        if existing:
+            # Same content from another URL or mirror: keep a single copy,
+            # and report it as already saved rather than newly downloaded
+            part_path.unlink()
+            self.remember(urls + [r.url], digest, existing)
+            return existing, False
+        path = unique_path(filepath)
+        os.replace(part_path, path)
+        self.remember(urls + [r.url], digest, path)
+        return path, True
+
+
+def unique_path(filepath):
+    if not filepath.exists():
+        return filepath
+    n = 2
+    while True:
+        candidate = filepath.with_name(
+            f"{filepath.stem} ({n}){filepath.suffix}")
+        if not candidate.exists():
+            return candidate
+        n += 1
+
+
+download_stores = {}
+download_stores_lock = threading.Lock()
+
+
+def get_download_store(folder=None):
+    folder = Path(folder or get_download_dir())
+    with download_stores_lock:
+        store = download_stores.get(folder)
+        if store is None:
+            store = download_stores[folder] = DownloadStore(folder)
+        return store
+
+
+# --- Download Link Resolution ---
+
+PREFETCH_TOP_N = 20
+PREFETCH_WORKERS = 2
+
+
+def head_file(url):
+    # None means the file definitely isn't there. Anything else that isn't a
+    # 200 (429, 5xx, ...) raises, so the lookup isn't cached and is retried.
+    r = requests.head(url, allow_redirects=True, timeout=15)
+    if r.status_code == 405:
+        # Server doesn't allow HEAD; read just the headers of a GET
+        r = requests.get(url, allow_redirects=True, timeout=15, stream=True)
+        r.close()
+    if r.status_code in (404, 410):
+        return None
+    r.raise_for_status()
+    size = r.headers.get('Content-Length')
+    return r.url, int(size) if size and size.isdigit() else None
+
+
+def resolve_download(url, ext=""):
+    # Work out the direct file URL for a result row. Returns a dict with
+    # url/ext/size, or None when the source only has a landing page.
+    if "gutenberg.org" in url:
+        book_id = re.search(r'/(\d+)', url)
+        if book_id:
+            book_id = book_id.group(1)
+            for variant in ("epub.images", "epub.noimages", "epub"):
+                found = head_file(
+                    f"https://www.gutenberg.org/ebooks/{book_id}.{variant}")
+                if found:
+                    return {'url': found[0], 'ext': 'epub', 'size': found[1]}
+        return None
+    if "standardebooks.org/ebooks/" in url:
+        parts = url.split("standardebooks.org/ebooks/",
+                          1)[1].strip("/").split("/")
+        file_url = (f"https://standardebooks.org/ebooks/{'/'.join(parts)}"
+                    f"/downloads/{'_'.join(parts)}.epub")
+        found = head_file(file_url)
+        if found:
+            return {'url': found[0], 'ext': 'epub', 'size': found[1]}
+        return None
+    identifier = ia_identifier(url)
+    if identifier:
+        file_info, file_ext = ia_pick_file(ia_fetch_files(identifier), ext)
+        if file_info:
+            size = file_info.get('size')
+            return {
+                'url':
+                IA_DOWNLOAD_URL.format(
+                    identifier=identifier,
+                    name=requests.utils.quote(file_info['name'])),
+                'ext': file_ext,
+                'size': int(size) if size and size.isdigit() else None
+            }
+    return None
+
+
+class LinkPrefetcher:
+    # Resolves download links for the top visible rows in the background
+    # with a small fixed worker pool. Workers pause whenever a user-initiated
+    # resolve() is running, and queued work from older views is dropped.
+
+    def __init__(self, on_resolved=None, workers=PREFETCH_WORKERS):
+        self.on_resolved = on_resolved
+        self.cache = {}
+        self.in_flight = set()
+        self.user_active = 0
+        self.generation = 0
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        for _ in range(workers):
+            threading.Thread(target=self.worker, daemon=True).start()
+
+    def schedule(self, rows):
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+            pending = [(url, ext) for url, ext in rows
+                       if url not in self.cache and url not in self.in_flight]
+        for url, ext in pending:
+            self.queue.put((generation, url, ext))
+
+    def cached(self, url):
+        with self.lock:
+            return self.cache.get(url)
+
+    def worker(self):
+        while True:
+            generation, url, ext = self.queue.get()
+            with self.lock:
+                while self.user_active:
+                    self.changed.wait()
+                if (generation != self.generation or url in self.cache
+                        or url in self.in_flight):
+                    continue
+                self.in_flight.add(url)
+            try:
+                resolution = resolve_download(url, ext)
+            except Exception as e:
+                print("Prefetch error:", e)
+                with self.lock:
+                    self.in_flight.discard(url)
+                    self.changed.notify_all()
+                continue
+            with self.lock:
+                self.in_flight.discard(url)
+                self.cache[url] = resolution
+                self.changed.notify_all()
+            if resolution and self.on_resolved:
+                self.on_resolved(url, resolution)
+
+    def resolve(self, url, ext=""):
+        with self.lock:
+            # A worker may already be halfway through this exact URL
+            while url in self.in_flight:
+                self.changed.wait()
+            if url in self.cache:
+                return self.cache[url]
+            self.user_active += 1
+        try:
+            resolution = resolve_download(url, ext)
+            with self.lock:
+                self.cache[url] = resolution
+            return resolution
+        finally:
+            with self.lock:
+                self.user_active -= 1
+                self.changed.notify_all()
+
+
+# --- Local Library ---
+
+LIBRARY_INDEX_FILE = ".oliveheron_library.json"
+LIBRARY_EXTENSIONS = ['epub', 'pdf', 'mobi', 'azw3', 'txt', 'html', 'zip']
+OPF_NS = {
+    'opf': 'http://www.idpf.org/2007/opf',
+    'dc': 'http://purl.org/dc/elements/1.1/'
+}
+CONTAINER_NS = {'c': 'urn:oasis:names:tc:opendocument:xmlns:container'}
+
+
+def find_opf(zf):
+    # The central directory already lists every member, so an archive with a
+    # single .opf needs no extra reads; only fall back to container.xml when
+    # that is ambiguous.
+    names = [n for n in zf.namelist() if n.lower().endswith('.opf')]
+    if len(names) == 1:
+        return names[0]
+    try:
+        root = ET.fromstring(zf.read('META-INF/container.xml'))
+        rootfile = root.find('.//c:rootfile', CONTAINER_NS)
+        if rootfile is not None and rootfile.get('full-path'):
+            return rootfile.get('full-path')
+    except (KeyError, ET.ParseError):
+        pass
+    return names[0] if names else None
+
+
+def read_book_metadata(path):
+    path = Path(path)
+    meta = {
+        'title': path.stem.replace("_", " "),
+        'author': "",
+        'year': "",
+        'ext': path.suffix.lstrip('.').lower(),
+        'cover': ""
+    }
+    if meta['ext'] not in ('epub', 'zip'):
+        return meta
+    try:
+        with zipfile.ZipFile(path) as zf:
+            opf_name = find_opf(zf)
+            if not opf_name:
+                return meta
+            root = ET.fromstring(zf.read(opf_name))
+    except Exception as e:
+        # Encrypted members, unsupported compression, unknown XML encodings
+        # etc.: one bad book must not stop the whole folder being indexed.
+        print("Library metadata error:", path, e)
+        return meta
+    title = root.findtext('.//dc:title', namespaces=OPF_NS)
+    if title and title.strip():
+        meta['title'] = title.strip()
+    meta['author'] = "; ".join(
+        c.text.strip() for c in root.iterfind('.//dc:creator', OPF_NS)
+        if c.text and c.text.strip())
+    date = root.findtext('.//dc:date', default="", namespaces=OPF_NS)
+    year = re.match(r'\s*(\d{4})', date)
+    meta['year'] = year.group(1) if year else ""
+
+    cover_id = None
+    for m in root.iterfind('.//opf:meta', OPF_NS):
+        if m.get('name') == 'cover':
+            cover_id = m.get('content')
+    for item in root.iterfind('.//opf:manifest/opf:item', OPF_NS):
+        if ('cover-image' in (item.get('properties') or "").split()
+                or (cover_id and item.get('id') == cover_id)):
+            meta['cover'] = posixpath.normpath(
+                posixpath.join(posixpath.dirname(opf_name),
+                               unquote(item.get('href', ""))))
+            break
+    return meta
+
+
+def read_book_cover(path, member):
+    with zipfile.ZipFile(path) as zf:
+        return zf.read(member)
+
+
+def open_local_file(path):
+    path = Path(path)
+    ext = path.suffix.lstrip('.').lower()
+    app = settings.get('per_ext_app', {}).get(ext) or settings.get(
+        'default_app')
+    if app:
+        subprocess.Popen([app, str(path)])
+    elif sys.platform == "win32":
+        os.startfile(str(path))
+    else:
+        webbrowser.open(path.as_uri())
+
+
+class LibraryIndex:
+    # Cached metadata for the books in one folder, keyed by relative path.
+    # Entries are reused while a file's mtime and size are unchanged.
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.index_path = self.folder / LIBRARY_INDEX_FILE
+        self.lock = threading.Lock()
+        self.scan_lock = threading.Lock()
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except Exception as e:
+            print("Library index load error:", e)
+
+    def save(self):
+        tmp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        try:
+            with self.lock:
+                data = json.dumps(self.entries)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            print("Library index save error:", e)
+
+    def books(self):
+        with self.lock:
+            return sorted(self.entries.items(),
+                          key=lambda item: item[1]['title'].lower())
+
+    def scan(self):
+        # Returns True if anything was added, changed or removed
+        with self.scan_lock:
+            seen = set()
+            changed = False
+            for dirpath, dirnames, filenames in os.walk(self.folder):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                for name in filenames:
+                    ext = name.rsplit('.', 1)[-1].lower()
+                    if name.startswith('.') or ext not in LIBRARY_EXTENSIONS:
+                        continue
+                    path = Path(dirpath) / name
+                    key = path.relative_to(self.folder).as_posix()
+                    seen.add(key)
+                    try:
+                        st = path.stat()
+                    except OSError:
+                        continue
+                    with self.lock:
+                        entry = self.entries.get(key)
+                    if (entry and entry['mtime'] == st.st_mtime
+                            and entry['size'] == st.st_size):
+                        continue
+                    entry = read_book_metadata(path)
+                    entry['mtime'] = st.st_mtime
+                    entry['size'] = st.st_size
+                    with self.lock:
+                        self.entries[key] = entry
+                    changed = True
+            with self.lock:
+                for key in set(self.entries) - seen:
+                    del self.entries[key]
+                    changed = True
+            if changed:
+                self.save()
+            return changed
+
+
+library_indexes = {}
+library_indexes_lock = threading.Lock()
+
+
+def get_library_index(folder=None):
+    folder = Path(folder or get_download_dir())
+    with library_indexes_lock:
+        index = library_indexes.get(folder)
+        if index is None:
+            index = library_indexes[folder] = LibraryIndex(folder)
+        return index
+
+
+# --- Cover Thumbnails ---
+
+THUMB_SIZE = (48, 72)
+COVER_WORKERS = 2
+COVER_MEMORY_BUDGET = 8 * 1024 * 1024  # bytes of decoded thumbnails
+COVER_CACHE_DIR = Path.home() / ".oliveheron" / "covers"
+
+
+def cover_url(row):
+    url = row[5]
+    if "gutenberg.org" in url:
+        book_id = re.search(r'/(\d+)', url)
+        if book_id:
+            book_id = book_id.group(1)
+            return (f"https://www.gutenberg.org/cache/epub/{book_id}"
+                    f"/pg{book_id}.cover.small.jpg")
+    if "standardebooks.org/ebooks/" in url:
+        path = url.split("standardebooks.org/ebooks/", 1)[1].strip("/")
+        return (f"https://standardebooks.org/ebooks/{path}"
+                "/downloads/cover-thumbnail.jpg")
+    identifier = ia_identifier(url)
+    if identifier:
+        return f"https://archive.org/services/img/{identifier}"
+    return None
+
+
+def thumbnail_png(data, size=THUMB_SIZE):
+    # Downscale any image Pillow can read to PNG bytes Tk can display.
+    # Without Pillow, only PNG/GIF data is usable as-is.
+    if Image is None:
+        if data[:8] == b"\x89PNG\r\n\x1a\n" or data[:4] == b"GIF8":
+            return data
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.thumbnail(size)
+            out = io.BytesIO()
+            img.convert("RGBA").save(out, format="PNG")
+            return out.getvalue()
+    except Exception as e:
+        print("Cover decode error:", e)
+        return None
+
+
+def decode_thumbnail(data, size=THUMB_SIZE):
+    # Must run on the Tk thread
+    try:
+        image = tk.PhotoImage(data=base64.b64encode(data))
+    except tk.TclError:
+        return None
+    factor = max(1, math.ceil(image.width() / size[0]),
+                 math.ceil(image.height() / size[1]))
+    return image.subsample(factor) if factor > 1 else image
+
+
+def load_cover(url):
+    # None means there is no usable cover (404/410 or undecodable data).
+    # Other failures raise so the fetcher can try again later.
+    cache_path = COVER_CACHE_DIR / (hashlib.sha1(url.encode()).hexdigest() +
+                                    ".png")
+    if cache_path.exists():
+        return cache_path.read_bytes()
+    r = requests.get(url, timeout=15, headers={"User-Agent": "Mozilla/5.0"})
+    if r.status_code in (404, 410):
+        return None
+    r.raise_for_status()
+    data = thumbnail_png(r.content)
+    if data:
+        try:
+            COVER_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            cache_path.write_bytes(data)
+        except OSError as e:
+            print("Cover cache error:", e)
+    return data
+
+
+class ThumbnailCache:
+    # LRU of decoded PhotoImages, bounded by their pixel memory. Tk-thread
+    # only. Tree items hold only the Tk image name, so an evicted image is
+    # deleted as soon as it is garbage-collected; put() returns the evicted
+    # URLs so the caller can clear those rows, and never evicts URLs in keep.
+
+    def __init__(self, budget=COVER_MEMORY_BUDGET):
+        self.budget = budget
+        self.used = 0
+        self.images = OrderedDict()
+
+    def get(self, url):
+        entry = self.images.get(url)
+        if entry is None:
+            return None
+        self.images.move_to_end(url)
+        return entry[0]
+
+    def put(self, url, image, keep=()):
+        if url in self.images:
+            self.used -= self.images.pop(url)[1]
+        size = image.width() * image.height() * 4
+        self.images[url] = (image, size)
+        self.used += size
+        evicted = []
+        for old_url in list(self.images):
+            if self.used <= self.budget:
+                break
+            if old_url == url or old_url in keep:
+                continue
+            self.used -= self.images.pop(old_url)[1]
+            evicted.append(old_url)
+        return evicted
+
+
+class CoverFetcher:
+    # Fetches covers for the rows currently on screen with a fixed number of
+    # workers. Each request() replaces the pending list, so covers for rows
+    # that scrolled away are dropped before they are fetched.
+
+    def __init__(self, on_loaded, workers=COVER_WORKERS):
+        self.on_loaded = on_loaded
+        self.pending = []
+        self.in_flight = set()
+        self.failed = set()
+        self.changed = threading.Condition()
+        for _ in range(workers):
+            threading.Thread(target=self.worker, daemon=True).start()
+
+    def request(self, urls):
+        with self.changed:
+            self.pending = [
+                url for url in dict.fromkeys(urls)
+                if url not in self.in_flight and url not in self.failed
+            ]
+            self.changed.notify_all()
+
+    def worker(self):
+        while True:
+            with self.changed:
+                while not self.pending:
+                    self.changed.wait()
+                url = self.pending.pop(0)
+                self.in_flight.add(url)
+            try:
+                data = load_cover(url)
+            except Exception as e:
+                # Timeouts, 429, 5xx...: not failed, the next request() retries
+                print("Cover fetch error:", e)
+                with self.changed:
+                    self.in_flight.discard(url)
+                continue
+            with self.changed:
+                self.in_flight.discard(url)
+                if data is None:
+                    self.failed.add(url)
+            if data is not None:
+                self.on_loaded(url, data)
+
+
+# --- UI Event Queue & Watchdog ---
+
+UI_DRAIN_INTERVAL = 16  # ms between drains of the worker -> UI queue
+UI_DRAIN_BUDGET = 0.008  # seconds of queued callbacks run per drain
+HEARTBEAT_INTERVAL = 50  # ms
+STALL_THRESHOLD = 0.2  # seconds the main loop may be late before we log it
+STALL_LOG_SIZE = 100
+
+
+def callback_name(fn):
+    return getattr(fn, '__qualname__', None) or repr(fn)
+
+
+class MainLoopWatchdog:
+    # A heartbeat on the Tk loop is checked from a background thread. When it
+    # is late, the main thread's stack is sampled to find the callback that is
+    # blocking it; queued UI callbacks are also timed directly.
+
+    def __init__(self, root, threshold=STALL_THRESHOLD):
+        self.root = root
+        self.threshold = threshold
+        self.main_ident = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.current = None
+        self.culprit = None
+        self.timed_stall = False  # run() already logged the current stall
+        self.stalls = deque(maxlen=STALL_LOG_SIZE)
+        self.lock = threading.Lock()
+        root.after(HEARTBEAT_INTERVAL, self.beat)
+        threading.Thread(target=self.monitor, daemon=True).start()
+
+    def beat(self):
+        now = time.monotonic()
+        late = now - self.last_beat - HEARTBEAT_INTERVAL / 1000
+        with self.lock:
+            self.last_beat = now
+            culprit, self.culprit = self.culprit, None
+        if late > self.threshold and not self.timed_stall:
+            self.record(late, culprit or "unknown (stall ended before sample)")
+        self.timed_stall = False
+        self.root.after(HEARTBEAT_INTERVAL, self.beat)
+
+    def monitor(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL / 1000)
+            with self.lock:
+                late = time.monotonic() - self.last_beat
+                if late < self.threshold or self.culprit:
+                    continue
+                self.culprit = self.current or self.sample_main()
+
+    def sample_main(self):
+        frame = sys._current_frames().get(self.main_ident)
+        ours = []
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename == __file__ and code.co_name != '<module>':
+                ours.append((getattr(code, 'co_qualname', code.co_name),
+                             frame.f_lineno))
+            frame = frame.f_back
+        if not ours:
+            return "outside OliveHERON code"
+        outer, inner = ours[-1], ours[0]
+        if outer == inner:
+            return f"{outer[0]} (line {outer[1]})"
+        return f"{outer[0]} -> {inner[0]} (line {inner[1]})"
+
+    def run(self, fn, *args):
+        name = callback_name(fn)
+        self.current = name
+        start = time.monotonic()
+        try:
+            fn(*args)
+        finally:
+            self.current = None
+            elapsed = time.monotonic() - start
+            if elapsed > self.threshold:
+                self.timed_stall = True
+                self.record(elapsed, f"queued {name}")
+
+    def record(self, seconds, culprit):
+        self.stalls.append((time.time(), seconds, culprit))
+        print(f"UI stall: {seconds:.2f}s in {culprit}")
 
 
 class SettingsDialog(tk.Toplevel):
@@ -481,6 +1717,10 @@ class SettingsDialog(tk.Toplevel):
             value=settings['filter_explicit'])
         self.show_welcome_var = tk.BooleanVar(value=settings['show_welcome'])
         self.show_features_var = tk.BooleanVar(value=settings['show_features'])
+        self.stream_scrape_var = tk.BooleanVar(
+            value=settings.get('stream_scrape', True))
+        self.show_covers_var = tk.BooleanVar(
+            value=settings.get('show_covers', False))
         self.default_download_dir_var = tk.StringVar(
             value=settings['default_download_dir'])
 
@@ -529,6 +1769,28 @@ class SettingsDialog(tk.Toplevel):
                                        padx=10,
                                        pady=5)
         row += 1
+        tk.Checkbutton(self,
+                       text="Stream Results While Loading",
+                       variable=self.stream_scrape_var,
+                       bg=get_theme()['bg'],
+                       fg=get_theme()['fg'],
+                       font=FONT).grid(row=row,
+                                       column=0,
+                                       sticky='w',
+                                       padx=10,
+                                       pady=5)
+        row += 1
+        tk.Checkbutton(self,
+                       text="Show Cover Thumbnails",
+                       variable=self.show_covers_var,
+                       bg=get_theme()['bg'],
+                       fg=get_theme()['fg'],
+                       font=FONT).grid(row=row,
+                                       column=0,
+                                       sticky='w',
+                                       padx=10,
+                                       pady=5)
+        row += 1
         tk.Label(self,
                  text="Default Download Directory:",
                  bg=get_theme()['bg'],
@@ -553,7 +1815,10 @@ class SettingsDialog(tk.Toplevel):
         row += 1
 
         tk.Label(self,
-                 text="Custom Searchbases (URLs with {query}):",
+                 text="Custom Searchbases (URLs with {query}):\n"
+                 "optional: | row=css | title=css | author=css\n"
+                 "| year=css | ext=css | link=css",
+                 justify='left',
                  bg=get_theme()['bg'],
                  fg=get_theme()['fg'],
                  font=FONT).grid(row=row,
@@ -573,7 +1838,9 @@ class SettingsDialog(tk.Toplevel):
                                    padx=10,
                                    pady=5)
         self.searchbases_text.insert(
-            '1.0', "\n".join(settings.get('user_searchbases', [])))
+            '1.0', "\n".join(
+                format_searchbase(base)
+                for base in settings.get('user_searchbases', [])))
         row += 1
 
         tk.Button(self,
@@ -599,9 +1866,11 @@ class SettingsDialog(tk.Toplevel):
         settings['filter_explicit'] = self.filter_explicit_var.get()
         settings['show_welcome'] = self.show_welcome_var.get()
         settings['show_features'] = self.show_features_var.get()
+        settings['stream_scrape'] = self.stream_scrape_var.get()
+        settings['show_covers'] = self.show_covers_var.get()
         settings['default_download_dir'] = self.default_download_dir_var.get()
         settings['user_searchbases'] = [
-            line.strip()
+            parse_searchbase(line.strip())
             for line in self.searchbases_text.get('1.0', 'end').splitlines()
             if line.strip()
         ]
@@ -610,7 +1879,8 @@ class SettingsDialog(tk.Toplevel):
         self.destroy()
         messagebox.showinfo(
             "Settings",
-            "Settings saved. Please restart OliveHERON to apply theme changes."
+            "Settings saved. Please restart OliveHERON to apply theme and "
+            "cover changes."
         )
 
     def cancel(self):
@@ -618,6 +1888,141 @@ class SettingsDialog(tk.Toplevel):
         self.destroy()
 
 
+class LibraryWindow(tk.Toplevel):
+
+    def __init__(self, master):
+        super().__init__(master)
+        self.title("Library")
+        self.geometry("1000x550")
+        self.configure(bg=get_theme()['bg'])
+        self.transient(master)
+
+        self.index = get_library_index()
+        self.cover_image = None
+        theme = get_theme()
+
+        tk.Label(self,
+                 text=f"Library: {self.index.folder}",
+                 bg=theme['bg'],
+                 fg=theme['fg'],
+                 font=FONT).pack(fill='x', padx=10, pady=5)
+        body = tk.Frame(self, bg=theme['bg'])
+        body.pack(expand=True, fill='both', padx=10, pady=5)
+        columns = ["Title", "Author", "Year", "Ext", "File"]
+        self.tree = ttk.Treeview(body,
+                                 columns=columns,
+                                 show='headings',
+                                 selectmode='extended')
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=180, anchor='w')
+        self.tree.pack(side='left', expand=True, fill='both')
+        self.tree.bind('<Double-1>', self.open_selected)
+        self.tree.bind('<<TreeviewSelect>>', self.show_cover)
+        self.cover_label = tk.Label(body,
+                                    text="",
+                                    width=24,
+                                    bg=theme['bg'],
+                                    fg=theme['fg'],
+                                    font=FONT)
+        self.cover_label.pack(side='right', fill='y', padx=(10, 0))
+
+        btn_frame = tk.Frame(self, bg=theme['bg'])
+        btn_frame.pack(fill='x', padx=10, pady=5)
+        tk.Button(btn_frame,
+                  text="Open Selected",
+                  font=FONT,
+                  bg=theme['button_bg'],
+                  fg=theme['button_fg'],
+                  command=self.open_selected).pack(side='left', padx=5)
+        tk.Button(btn_frame,
+                  text="Close",
+                  font=FONT,
+                  bg=theme['button_bg'],
+                  fg=theme['button_fg'],
+                  command=self.destroy).pack(side='right', padx=5)
+
+        # Show whatever is already indexed, then rescan in the background
+        self.show_books()
+        threading.Thread(target=self.scan_thread, daemon=True).start()
+
+    def scan_thread(self):
+        if self.index.scan():
+            self.master.post_ui(self.show_books)
+
+    def show_books(self):
+        if not self.winfo_exists():
+            return  # Window closed while scanning
+        selected = self.tree.selection()
+        self.tree.delete(*self.tree.get_children())
+        for key, entry in self.index.books():
+            self.tree.insert('',
+                             'end',
+                             iid=key,
+                             values=(entry['title'], entry['author'],
+                                     entry['year'], entry['ext'], key))
+        self.tree.selection_set([k for k in selected if self.tree.exists(k)])
+
+    def show_cover(self, event=None):
+        selected = self.tree.selection()
+        self.cover_image = None
+        self.cover_label.config(image="", text="")
+        if not selected:
+            return
+        entry = self.index.entries.get(selected[0])
+        if entry and entry.get('cover'):
+            threading.Thread(target=self.cover_thread,
+                             args=(selected[0], entry['cover']),
+                             daemon=True).start()
+
+    def cover_thread(self, key, member):
+        try:
+            data = read_book_cover(self.index.folder / key, member)
+        except (zipfile.BadZipFile, KeyError, OSError) as e:
+            print("Library cover error:", e)
+            return
+        data = thumbnail_png(data, (180, 260)) or data
+        self.master.post_ui(self.set_cover, key, data)
+
+    def set_cover(self, key, data):
+        if not self.winfo_exists():
+            return
+        selected = self.tree.selection()
+        if not selected or selected[0] != key:
+            return
+        image = decode_thumbnail(data, (180, 260))
+        if image is None:
+            # Tk can only decode PNG/GIF covers without Pillow
+            self.cover_label.config(text="(cover not\npreviewable)")
+            return
+        self.cover_image = image
+        self.cover_label.config(image=self.cover_image, text="")
+
+    def open_selected(self, event=None):
+        paths = [self.index.folder / key for key in self.tree.selection()]
+        threading.Thread(target=self.open_thread, args=(paths, ),
+                         daemon=True).start()
+
+    def open_thread(self, paths):
+        errors = []
+        for path in paths:
+            try:
+                open_local_file(path)
+            except Exception as e:
+                errors.append(f"{path.name}: {e}")
+        if errors:
+            self.master.post_ui(self.show_open_errors, errors)
+
+    def show_open_errors(self, errors):
+        # Modal dialogs go through after() so they don't block the UI queue
+        # drain or get timed by the watchdog as a stall.
+        self.master.after(0,
+                          lambda: messagebox.showerror(
+                              "Open Error",
+                              "\n".join(errors),
+                              parent=self if self.winfo_exists() else None))
+
+
 class OliveHeronApp(tk.Tk):
 
     def __init__(self):
@@ -631,9 +2036,25 @@ class OliveHeronApp(tk.Tk):
         self.filter_explicit_var = tk.BooleanVar(
             value=settings.get('filter_explicit', True))
         self.results = []
+        self.search_generation = 0
+        self.ia_requested = set()
+        self.enrich_pending = None
+        self.ui_queue = queue.SimpleQueue()
+        self.watchdog = MainLoopWatchdog(self)
+        self.after(UI_DRAIN_INTERVAL, self.drain_ui_queue)
+        self.prefetcher = LinkPrefetcher(
+            on_resolved=lambda url, res: self.post_ui(self.apply_prefetch, url,
+                                                      res))
         self.result_columns = [
             "Title", "Author", "Year", "Ext", "Source", "URL"
         ]
+        self.show_covers = settings.get('show_covers', False)
+        self.thumbnails = ThumbnailCache()
+        self.cover_rows = {}  # cover URL -> iids currently showing it
+        self.cover_fetcher = CoverFetcher(
+            on_loaded=lambda url, data: self.post_ui(self.apply_cover, url,
+                                                     data)
+        ) if self.show_covers else None
 
         self.create_widgets()
         if settings.get('show_features', True):
@@ -670,6 +2091,12 @@ class OliveHeronApp(tk.Tk):
                   bg=theme['button_bg'],
                   fg=theme['button_fg'],
                   command=self.open_settings).pack(side='right', padx=5)
+        tk.Button(search_frame,
+                  text="Library",
+                  font=FONT,
+                  bg=theme['button_bg'],
+                  fg=theme['button_fg'],
+                  command=self.open_library).pack(side='right', padx=5)
         tk.Checkbutton(search_frame,
                        text="Filter Explicit",
                        variable=self.filter_explicit_var,
@@ -690,15 +2117,27 @@ class OliveHeronApp(tk.Tk):
                         background=theme['tree_head_bg'],
                         foreground=theme['tree_head_fg'],
                         font=FONT)
-        self.tree = ttk.Treeview(self,
-                                 columns=columns,
-                                 show='headings',
-                                 selectmode='extended')
+        style.configure("Covers.Treeview", rowheight=THUMB_SIZE[1] + 4)
+        self.tree = ttk.Treeview(
+            self,
+            columns=columns,
+            show='tree headings' if self.show_covers else 'headings',
+            style="Covers.Treeview" if self.show_covers else "Treeview",
+            selectmode='extended')
         for col in columns:
             self.tree.heading(col, text=col)
             self.tree.column(col, width=180 if col != "URL" else 0, anchor='w')
+        if self.show_covers:
+            self.tree.heading('#0', text="Cover")
+            self.tree.column('#0',
+                             width=THUMB_SIZE[0] + 24,
+                             stretch=False,
+                             anchor='center')
         self.tree.pack(expand=True, fill='both', padx=10, pady=5)
+        self.tree.configure(yscrollcommand=self.on_tree_scroll)
         self.tree.bind('<Double-1>', self.open_selected)
+        self.tree.bind('<<TreeviewSelect>>',
+                       lambda e: self.schedule_enrichment())
 
         # Buttons
         btn_frame = tk.Frame(self, bg=theme['bg'])
@@ -723,22 +2162,47 @@ class OliveHeronApp(tk.Tk):
                   command=self.choose_download_folder).pack(side='right',
                                                             padx=5)
 
+    def post_ui(self, fn, *args):
+        # The only way worker threads may reach widgets: queue a callback for
+        # the Tk thread to run. Callbacks must not block (no modal dialogs);
+        # schedule those with after() instead.
+        self.ui_queue.put((fn, args))
+
+    def drain_ui_queue(self):
+        deadline = time.monotonic() + UI_DRAIN_BUDGET
+        while time.monotonic() < deadline:
+            try:
+                fn, args = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                self.watchdog.run(fn, *args)
+            except Exception:
+                self.report_callback_exception(*sys.exc_info())
+        self.after(UI_DRAIN_INTERVAL, self.drain_ui_queue)
+
     def do_search(self):
         query = self.search_var.get().strip()
         if not query:
             messagebox.showinfo("No Query", "Please enter a search query.")
             return
         self.tree.delete(*self.tree.get_children())
+        self.cover_rows = {}
         self.results = []
+        self.ia_requested = set()
+        self.search_generation += 1
+        generation = self.search_generation
+        # Read Tk variables here; the search thread must not touch them
+        filter_explicit = self.filter_explicit_var.get()
         self.after(
             100, lambda: threading.Thread(target=self.search_thread,
-                                          args=(query, )).start())
+                                          args=(query, generation,
+                                                filter_explicit)).start())
 
-    def search_thread(self, query):
+    def search_thread(self, query, generation, filter_explicit):
         results = []
         lock = threading.Lock()
         threads = []
-        filter_explicit = self.filter_explicit_var.get()
         threads.append(
             threading.Thread(target=scrape_gutenberg,
                              args=(query, results, lock, filter_explicit)))
@@ -757,76 +2221,234 @@ class OliveHeronApp(tk.Tk):
         threads.append(
             threading.Thread(target=scrape_standard_ebooks,
                              args=(query, results, lock, filter_explicit)))
-        threads.append(
-            threading.Thread(target=scrape_user_searchbases,
-                             args=(query, results, lock, filter_explicit)))
+        for base in settings.get('user_searchbases', []):
+            threads.append(
+                threading.Thread(target=scrape_user_searchbase,
+                                 args=(base, query, results, lock,
+                                       filter_explicit)))
         for t in threads:
             t.start()
-        for t in threads:
-            t.join()
-        self.results = results
-        self.after(0, self.show_results)
+        # Push rows to the table as scrapers produce them
+        shown = 0
+        while True:
+            alive = any(t.is_alive() for t in threads)
+            with lock:
+                new_rows = results[shown:]
+            if new_rows:
+                shown += len(new_rows)
+                self.post_ui(self.append_results, generation, new_rows)
+            if not alive:
+                break
+            time.sleep(STREAM_REFRESH)
+        order = rank_order(query, results)
+        self.post_ui(self.apply_ranking, generation, order)
 
     def show_results(self):
         self.tree.delete(*self.tree.get_children())
-        for row in self.results:
-            self.tree.insert('', 'end', values=row)
+        self.cover_rows = {}
+        for i, row in enumerate(self.results):
+            self.tree.insert('', 'end', iid=str(i), values=row)
+        self.schedule_enrichment()
+
+    def apply_ranking(self, generation, order):
+        if (generation != self.search_generation
+                or len(order) != len(self.results)):
+            return
+        selected = {self.results[int(iid)][5] for iid in self.tree.selection()}
+        selected.discard("")
+        self.results = [self.results[i] for i in order]
+        self.show_results()
+        self.tree.selection_set([
+            str(i) for i, row in enumerate(self.results) if row[5] in selected
+        ])
+        self.tree.yview_moveto(0)
+
+    def append_results(self, generation, rows):
+        if generation != self.search_generation:
+            return  # Rows from a search that has since been replaced
+        for row in rows:
+            self.tree.insert('',
+                             'end',
+                             iid=str(len(self.results)),
+                             values=row)
+            self.results.append(row)
+        self.schedule_enrichment()
+
+    def visible_items(self):
+        children = self.tree.get_children()
+        if not children:
+            return []
+        top, bottom = self.tree.yview()
+        start = int(top * len(children))
+        end = min(len(children), int(bottom * len(children)) + 1)
+        return list(children[start:end])
+
+    def on_tree_scroll(self, first, last):
+        self.schedule_enrichment()
+
+    def schedule_enrichment(self):
+        # Debounce: scrolling fires many events, only fetch once it settles
+        if self.enrich_pending:
+            self.after_cancel(self.enrich_pending)
+        self.enrich_pending = self.after(150, self.enrich_visible)
+
+    def enrich_visible(self):
+        self.enrich_pending = None
+        visible = self.visible_items()
+        self.request_covers(visible)
+        self.prefetcher.schedule([(self.results[int(iid)][5],
+                                   self.results[int(iid)][3])
+                                  for iid in visible[:PREFETCH_TOP_N]
+                                  if self.results[int(iid)][5]])
+        wanted = {}
+        for iid in visible + list(self.tree.selection()):
+            row = self.results[int(iid)]
+            if row[4] != "Internet Archive" or row[3]:
+                continue
+            identifier = ia_identifier(row[5])
+            if identifier and identifier not in self.ia_requested:
+                self.ia_requested.add(identifier)
+                wanted[identifier] = row[5]
+        if wanted:
+            threading.Thread(target=self.enrich_thread,
+                             args=(wanted, ),
+                             daemon=True).start()
+
+    def enrich_thread(self, wanted):
+        exts = ia_fetch_formats(list(wanted))
+        failed = set(wanted) - set(exts)
+        if failed:
+            # Lookup failed (not just "no format"): allow a later retry
+            self.post_ui(self.ia_requested.difference_update, failed)
+        updates = {
+            wanted[identifier]: ext
+            for identifier, ext in exts.items() if ext
+        }
+        if updates:
+            self.post_ui(self.apply_enrichment, updates)
+
+    def apply_enrichment(self, updates):
+        # Match rows by link: ranking may have reordered the table (and so
+        # changed every iid) since the lookup was started.
+        for index, row in enumerate(self.results):
+            ext = updates.get(row[5])
+            if ext and not row[3]:
+                row = row[:3] + (ext, ) + row[4:]
+                self.results[index] = row
+                if self.tree.exists(str(index)):
+                    self.tree.item(str(index), values=row)
+
+    def request_covers(self, items):
+        if not self.cover_fetcher:
+            return
+        wanted = []
+        for iid in items:
+            url = cover_url(self.results[int(iid)])
+            if not url:
+                continue
+            image = self.thumbnails.get(url)
+            if image:
+                self.set_row_cover(iid, url, image)
+            else:
+                wanted.append(url)
+        self.cover_fetcher.request(wanted)
+
+    def set_row_cover(self, iid, url, image):
+        self.tree.item(iid, image=image)
+        self.cover_rows.setdefault(url, set()).add(iid)
+
+    def apply_cover(self, url, data):
+        image = decode_thumbnail(data)
+        if image is None:
+            return
+        visible = {
+            iid: cover_url(self.results[int(iid)])
+            for iid in self.visible_items()
+        }
+        evicted = self.thumbnails.put(url, image, keep=set(visible.values()))
+        # Rows showing an evicted image would go blank; clear them so
+        # request_covers fetches the cover again when they are visible.
+        for old_url in evicted:
+            for iid in self.cover_rows.pop(old_url, ()):
+                if self.tree.exists(iid):
+                    self.tree.item(iid, image="")
+        for iid, row_url in visible.items():
+            if row_url == url:
+                self.set_row_cover(iid, url, image)
+
+    def apply_prefetch(self, url, resolution):
+        # Fill in the format for rows whose source didn't report one
+        self.apply_enrichment({url: resolution['ext']})
 
     def download_selected(self):
         selected = self.tree.selection()
         if not selected:
             messagebox.showinfo("No Selection", "Select a file to download.")
             return
+        jobs = []
         for item in selected:
             vals = self.tree.item(item, "values")
             url = vals[-1]
             filename = vals[0].replace(
                 " ", "_") + "." + (vals[3] if vals[3] else "epub")
-            self.download_file(url, filename)
+            jobs.append((url, filename))
+        threading.Thread(target=self.download_thread,
+                         args=(jobs, ),
+                         daemon=True).start()
+
+    def download_thread(self, jobs):
+        outcomes = [self.download_file(url, name) for url, name in jobs]
+        self.post_ui(self.show_download_summary, outcomes)
+
+    def show_download_summary(self, outcomes):
+        # One dialog per batch rather than one per file
+        messages = {
+            'saved': "Saved to {}",
+            'exists': "Already saved at {}",
+            'browser': "Opened in browser (direct download not available): {}",
+            'error': "Error: {}"
+        }
+        text = "\n".join(messages[status].format(detail)
+                         for status, detail in outcomes)
+        # Modal dialogs go through after() so they don't block the UI queue
+        # drain or get timed by the watchdog as a stall.
+        if any(status == 'error' for status, _ in outcomes):
+            self.after(0, messagebox.showerror, "Download Error", text)
+        else:
+            self.after(0, messagebox.showinfo, "Download Complete", text)
 
     def download_file(self, url, filename):
+        # Runs on a worker thread; returns (status, detail) for the summary
         folder = get_download_dir()
         filepath = folder / filename
+        store = get_download_store(folder)
         try:
-            if "gutenberg.org" in url:
-                book_id = re.search(r'/(\d+)', url)
-                if book_id:
-                    book_id = book_id.group(1)
-                    epub_url = f"https://www.gutenberg.org/ebooks/{book_id}.epub.images"
-                    r = requests.get(epub_url,
-                                     allow_redirects=True,
-                                     timeout=20)
-                    if r.status_code == 404:
-                        epub_url = f"https://www.gutenberg.org/ebooks/{book_id}.epub.noimages"
-                        r = requests.get(epub_url,
-                                         allow_redirects=True,
-                                         timeout=20)
-                    if r.status_code == 404:
-                        epub_url = f"https://www.gutenberg.org/ebooks/{book_id}.epub"
-                        r = requests.get(epub_url,
-                                         allow_redirects=True,
-                                         timeout=20)
-                    if r.status_code == 200:
-                        with open(filepath, "wb") as f:
-                            f.write(r.content)
-                        messagebox.showinfo("Download Complete",
-                                            f"Saved to {filepath}")
-                        return
+            path = store.lookup(url)
+            if path:
+                return 'exists', path
+            resolution = self.prefetcher.resolve(url,
+                                                 filepath.suffix.lstrip('.'))
+            if resolution:
+                target = filepath.with_suffix("." + resolution['ext'])
+                path, downloaded = store.fetch(resolution['url'], target, url)
+                if path:
+                    return ('saved' if downloaded else 'exists'), path
             webbrowser.open(url)
-            messagebox.showinfo(
-                "Redirected",
-                "File opened in browser (direct download not available).")
+            return 'browser', url
         except Exception as e:
-            messagebox.showerror("Download Error", str(e))
+            return 'error', f"{filename}: {e}"
 
     def open_selected(self, event=None):
         selected = self.tree.selection()
         if not selected:
             messagebox.showinfo("No Selection", "Select a file to open.")
             return
-        for item in selected:
-            vals = self.tree.item(item, "values")
-            url = vals[-1]
+        urls = [self.tree.item(item, "values")[-1] for item in selected]
+        threading.Thread(target=self.open_thread, args=(urls, ),
+                         daemon=True).start()
+
+    def open_thread(self, urls):
+        for url in urls:
             webbrowser.open(url)
 
     def choose_download_folder(self):
@@ -840,6 +2462,9 @@ class OliveHeronApp(tk.Tk):
     def open_settings(self):
         SettingsDialog(self)
 
+    def open_library(self):
+        LibraryWindow(self)
+
     def toggle_explicit(self):
         settings['filter_explicit'] = self.filter_explicit_var.get()
         save_settings()